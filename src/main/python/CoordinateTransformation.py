@@ -16,14 +16,390 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 """
 
+import io
+import os
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import freeze_support
 import pandas as pd
 import numpy as np
+from openpyxl import load_workbook
 from fbs_runtime.application_context.PyQt5 import ApplicationContext
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,\
-    QTableWidgetItem, QLabel, QMessageBox, QFileDialog, QRadioButton, QSpinBox, QShortcut, QMenu
-from PyQt5.QtGui import QGuiApplication, QKeySequence, QMouseEvent
-from PyQt5.QtCore import Qt
+    QTableWidgetItem, QLabel, QMessageBox, QFileDialog, QRadioButton, QSpinBox, QShortcut, QMenu, QCheckBox
+from PyQt5.QtGui import QGuiApplication, QKeySequence, QMouseEvent, QPainter, QImage, QColor, QPen
+from PyQt5.QtCore import Qt, QPointF
+
+
+def read_text_block(filename, start, stop, delimiter, usecol, dtype):
+    """
+    Parse the lines between the byte offsets start and stop of a delimited text file. Module level function, such
+    that it can be run in a process pool.
+
+    :param filename: file to read
+    :param start: byte offset of the first line
+    :param stop: byte offset after the last line
+    :param delimiter: delimiter of the columns
+    :param usecol: columns to read, in the order they are returned
+    :param dtype: dictionary with the data type of each column
+    :return: pd.DataFrame with the selected columns
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    # e.g. blank lines at the end of the file
+    if data.strip() == b'':
+        return pd.DataFrame(columns=usecol)
+    return pd.read_csv(io.BytesIO(data), delimiter=delimiter, header=None, usecols=usecol, dtype=dtype)[usecol]
+
+
+def excel_rows_to_frame(rows, usecol, dtype):
+    """
+    Convert rows of cell values, as read from an excel sheet, into a pd.DataFrame with the given data types.
+
+    :param rows: list of rows, each a list with the values of the columns in usecol
+    :param usecol: columns that were read
+    :param dtype: dictionary with the data type of each column, str or np.float64
+    :return: pd.DataFrame with one column per entry in usecol
+    """
+    columns = {}
+    for jt, col in enumerate(usecol):
+        values = [row[jt] for row in rows]
+        if dtype[col] is str:
+            columns[jt] = [np.nan if value is None else str(value) for value in values]
+        else:
+            try:
+                columns[jt] = np.array([np.nan if value is None else float(value) for value in values])
+            except TypeError:
+                raise ValueError('Could not convert the values in column ' + str(col + 1) + ' to numbers.')
+    return pd.DataFrame(columns)
+
+
+class DensityCloud:
+    """
+    Point cloud that can be binned quickly into a density image of any view.
+
+    The points are added block by block into preallocated arrays. When all points are added, finish() builds a level
+    of detail pyramid: the points are binned into grids of 1024, 4096, and 16384 cells per axis, of which only the
+    occupied cells are kept. A view is rendered from the coarsest grid whose cells are not larger than the pixels,
+    such that the work scales with the number of pixels and not with the number of points. The individual points are
+    only binned when the view is zoomed in beyond the grids and contains fewer than self.rawlimit points.
+    """
+
+    def __init__(self, size, dtype=np.float64):
+        self.x = np.full(size, np.nan, dtype=dtype)
+        self.y = np.full(size, np.nan, dtype=dtype)
+        self.bounds = None
+        # list of (gridsize, ix, iy, counts) of the occupied cells, from the coarsest to the finest grid
+        self.levels = []
+        # maximum number of points in the view that are binned individually
+        self.rawlimit = 200000
+
+    @classmethod
+    def from_points(cls, x, y):
+        # create a finished cloud from complete arrays
+        cloud = cls(len(x), np.result_type(x))
+        cloud.add(0, x, y)
+        cloud.finish()
+        return cloud
+
+    def add(self, start, x, y):
+        # add a block of points, starting at index start
+        self.x[start:start + len(x)] = x
+        self.y[start:start + len(y)] = y
+
+    def finish(self, gridsizes=(1024, 2048, 4096, 8192, 16384)):
+        """
+        Build the level of detail pyramid after all points are added.
+
+        :param gridsizes: number of cells per axis of the grids, powers of two, from coarse to fine
+        """
+        # points without finite coordinates are ignored
+        finite = np.isfinite(self.x) & np.isfinite(self.y)
+        self.x[~finite] = np.nan
+        self.y[~finite] = np.nan
+        npoints = int(np.count_nonzero(finite))
+        if npoints == 0:
+            return
+
+        xmin, xmax = float(np.nanmin(self.x)), float(np.nanmax(self.x))
+        ymin, ymax = float(np.nanmin(self.y)), float(np.nanmax(self.y))
+        # avoid zero extents, e.g., for a single point
+        if xmax == xmin:
+            xmin, xmax = xmin - 0.5, xmax + 0.5
+        if ymax == ymin:
+            ymin, ymax = ymin - 0.5, ymax + 0.5
+        self.bounds = (xmin, xmax, ymin, ymax)
+
+        # sort the cells of the finest grid in z-order, then the cells of a coarser grid are contiguous
+        finest = gridsizes[-1]
+        ix = np.minimum((self.x[finite] - xmin) * (finest / (xmax - xmin)), finest - 1).astype(np.uint32)
+        iy = np.minimum((self.y[finite] - ymin) * (finest / (ymax - ymin)), finest - 1).astype(np.uint32)
+        codes = self.interleave(ix) | (self.interleave(iy) << np.uint32(1))
+        del ix, iy
+        codes.sort()
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1))
+        codes = codes[starts]
+        counts = np.diff(np.append(starts, npoints))
+
+        levels = []
+        previous = finest
+        for gridsize in reversed(gridsizes):
+            # merge the cells of the previous, finer grid
+            shift = 2 * int(np.log2(previous // gridsize))
+            previous = gridsize
+            if shift > 0:
+                coarse = codes >> np.uint32(shift)
+                starts = np.concatenate(([0], np.flatnonzero(np.diff(coarse)) + 1))
+                codes = coarse[starts]
+                counts = np.add.reduceat(counts, starts)
+            # a grid with about as many cells as points saves nothing, bin the points instead
+            if len(codes) <= npoints // 2:
+                levels.insert(0, (gridsize, self.deinterleave(codes).astype(np.uint16),
+                                  self.deinterleave(codes >> np.uint32(1)).astype(np.uint16), counts))
+        self.levels = levels
+
+    @staticmethod
+    def interleave(v):
+        # spread the lower 16 bits of v to the even bits
+        v = v.astype(np.uint32)
+        v = (v | (v << np.uint32(8))) & np.uint32(0x00FF00FF)
+        v = (v | (v << np.uint32(4))) & np.uint32(0x0F0F0F0F)
+        v = (v | (v << np.uint32(2))) & np.uint32(0x33333333)
+        v = (v | (v << np.uint32(1))) & np.uint32(0x55555555)
+        return v
+
+    @staticmethod
+    def deinterleave(v):
+        # collect the even bits of v, inverse of interleave
+        v = v & np.uint32(0x55555555)
+        v = (v | (v >> np.uint32(1))) & np.uint32(0x33333333)
+        v = (v | (v >> np.uint32(2))) & np.uint32(0x0F0F0F0F)
+        v = (v | (v >> np.uint32(4))) & np.uint32(0x00FF00FF)
+        v = (v | (v >> np.uint32(8))) & np.uint32(0x0000FFFF)
+        return v
+
+    def density(self, view, width, height):
+        """
+        :param view: (xmin, xmax, ymin, ymax) of the view
+        :param width: width of the image in pixels
+        :param height: height of the image in pixels
+        :return: np.array (height, width) with the number of points per pixel
+        """
+        if self.bounds is None:
+            return np.zeros((height, width))
+        pixx = (view[1] - view[0]) / width
+        pixy = (view[3] - view[2]) / height
+        for level in self.levels:
+            if (self.bounds[1] - self.bounds[0]) / level[0] <= pixx and \
+                    (self.bounds[3] - self.bounds[2]) / level[0] <= pixy:
+                return self.bin_cells(level, view, width, height)
+
+        # zoomed in beyond the grids: bin the points if there are not too many in the view
+        if len(self.levels) > 0:
+            finest = self.levels[-1]
+            if np.sum(finest[3][self.cells_in_view(finest, view)]) > self.rawlimit:
+                return self.bin_cells(finest, view, width, height)
+        mask = (self.x >= view[0]) & (self.x <= view[1]) & (self.y >= view[2]) & (self.y <= view[3])
+        return self.bin(self.x[mask], self.y[mask], None, view, width, height)
+
+    def cells_in_view(self, level, view):
+        # mask of the occupied cells of a grid that overlap with the view
+        gridsize, ix, iy, counts = level
+        xmin, xmax, ymin, ymax = self.bounds
+        ixlo = int(np.floor((view[0] - xmin) * gridsize / (xmax - xmin)))
+        ixhi = int(np.floor((view[1] - xmin) * gridsize / (xmax - xmin)))
+        iylo = int(np.floor((view[2] - ymin) * gridsize / (ymax - ymin)))
+        iyhi = int(np.floor((view[3] - ymin) * gridsize / (ymax - ymin)))
+        if ixhi < 0 or iyhi < 0 or ixlo >= gridsize or iylo >= gridsize:
+            return np.zeros(len(ix), dtype=bool)
+        ixlo, iylo = max(ixlo, 0), max(iylo, 0)
+        ixhi, iyhi = min(ixhi, gridsize - 1), min(iyhi, gridsize - 1)
+        return (ix >= ixlo) & (ix <= ixhi) & (iy >= iylo) & (iy <= iyhi)
+
+    def bin_cells(self, level, view, width, height):
+        # bin the centers of the occupied cells of a grid, weighted with their number of points
+        gridsize, ix, iy, counts = level
+        xmin, xmax, ymin, ymax = self.bounds
+        mask = self.cells_in_view(level, view)
+        cellx = xmin + (ix[mask] + 0.5) * ((xmax - xmin) / gridsize)
+        celly = ymin + (iy[mask] + 0.5) * ((ymax - ymin) / gridsize)
+        return self.bin(cellx, celly, counts[mask], view, width, height)
+
+    @staticmethod
+    def bin(x, y, weights, view, width, height):
+        # bin the points into a (height, width) array, the first row is the top of the view
+        ix = np.floor((x - view[0]) * (width / (view[1] - view[0]))).astype(np.int64)
+        iy = np.floor((view[3] - y) * (height / (view[3] - view[2]))).astype(np.int64)
+        # points on the upper boundary belong to the last pixel
+        ix[x == view[1]] = width - 1
+        iy[y == view[2]] = height - 1
+        mask = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+        if weights is not None:
+            weights = weights[mask]
+        counts = np.bincount(iy[mask] * width + ix[mask], weights=weights, minlength=width * height)
+        return counts.reshape((height, width))
+
+
+class OverviewPlot(QWidget):
+    """
+    Overview of the original, reference, and calculated coordinates, drawn as density images. The residual vectors
+    from the calculated to the reference coordinates are drawn on top, the largest one highlighted.
+
+    Zoom with the mouse wheel, pan by dragging, and reset the view with a double click.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # colors of the clouds: original, reference, calculated
+        self.colors = [QColor(90, 90, 90), QColor(0, 150, 0), QColor(0, 90, 220)]
+        self.labels = ['x, y', 'x_ref, y_ref', 'x_calc, y_calc']
+        self.residcolor = QColor(220, 0, 0)
+        self.clouds = []
+        # has the table changed since the data was set?
+        self.stale = False
+        self.resid = np.zeros((0, 4))
+        self.view = None
+        self.image = None
+        # mouse position and view when dragging started
+        self.dragstart = None
+        self.dragoffset = None
+        self.dragview = None
+        self.setMinimumWidth(300)
+        self.setToolTip('Overview of the coordinates, updated after opening a file, calculating, or clearing. After\n'
+                        'pasting, deleting, or undoing, press \'Update plot\' to redraw it. The residuals of the\n'
+                        'reference points are shown in red, the largest one bold. Zoom with the mouse wheel, pan by\n'
+                        'dragging, and double click to reset the view.')
+
+    def set_data(self, clouds, resid):
+        """
+        :param clouds: list of finished DensityClouds for the original, reference, and calculated coordinates
+        :param resid: np.array (n, 4) with x_calc, y_calc, x_ref, y_ref for all reference points
+        """
+        self.clouds = clouds
+        self.resid = resid
+        self.stale = False
+        self.reset_view()
+
+    def set_stale(self):
+        # the table changed, the plot is kept until it is updated
+        self.stale = True
+        self.update()
+
+    def reset_view(self):
+        bounds = [cloud.bounds for cloud in self.clouds if cloud.bounds is not None]
+        if len(bounds) == 0:
+            self.view = None
+        else:
+            bounds = np.array(bounds)
+            xmin, xmax = np.min(bounds[:, 0]), np.max(bounds[:, 1])
+            ymin, ymax = np.min(bounds[:, 2]), np.max(bounds[:, 3])
+            # add a margin of 5% on each side
+            dx, dy = 0.05 * (xmax - xmin), 0.05 * (ymax - ymin)
+            self.view = (xmin - dx, xmax + dx, ymin - dy, ymax + dy)
+        self.rebuild()
+
+    def rebuild(self):
+        # render the density image for the current view and size
+        width, height = self.width(), self.height()
+        if self.view is None or width < 1 or height < 1:
+            self.image = None
+            self.update()
+            return
+
+        image = np.full((height, width, 3), 255.)
+        for cloud, color in zip(self.clouds, self.colors):
+            counts = cloud.density(self.view, width, height)
+            if not np.any(counts):
+                continue
+            # logarithmic density, such that single points stay visible next to dense regions
+            intensity = np.log1p(counts) / np.log1p(np.max(counts))
+            intensity = 0.3 + 0.7 * intensity
+            intensity[counts == 0] = 0.
+            for jt, comp in enumerate([color.red(), color.green(), color.blue()]):
+                image[:, :, jt] -= (255. - comp) * intensity
+        image = np.ascontiguousarray(np.clip(image, 0, 255).astype(np.uint8))
+        self.image = QImage(image.data, width, height, 3 * width, QImage.Format_RGB888).copy()
+        self.update()
+
+    def to_pixel(self, x, y):
+        # data coordinates to pixel coordinates of the current view
+        px = (x - self.view[0]) * self.width() / (self.view[1] - self.view[0])
+        py = (self.view[3] - y) * self.height() / (self.view[3] - self.view[2])
+        return px, py
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.white)
+        if self.image is not None:
+            # while dragging, move the old image until it is rebuilt
+            offset = QPointF(0, 0)
+            if self.dragstart is not None:
+                offset = QPointF(self.dragoffset)
+            painter.drawImage(offset, self.image)
+
+        if self.view is not None and len(self.resid) > 0:
+            painter.setRenderHint(QPainter.Antialiasing)
+            calcx, calcy = self.to_pixel(self.resid[:, 0], self.resid[:, 1])
+            refx, refy = self.to_pixel(self.resid[:, 2], self.resid[:, 3])
+            lengths = np.hypot(self.resid[:, 2] - self.resid[:, 0], self.resid[:, 3] - self.resid[:, 1])
+            worst = np.argmax(lengths)
+            for it in range(len(self.resid)):
+                pen = QPen(self.residcolor)
+                pen.setWidth(3 if it == worst else 1)
+                painter.setPen(pen)
+                painter.drawLine(QPointF(calcx[it], calcy[it]), QPointF(refx[it], refy[it]))
+                painter.drawEllipse(QPointF(refx[it], refy[it]), 4, 4)
+
+        # legend
+        for it, (label, color) in enumerate(zip(self.labels, self.colors)):
+            painter.setPen(color)
+            painter.drawText(5, 15 + 15 * it, label)
+        painter.setPen(self.residcolor)
+        painter.drawText(5, 15 + 15 * len(self.labels), 'residuals')
+        if self.stale:
+            painter.setPen(Qt.black)
+            painter.drawText(5, 15 + 15 * (len(self.labels) + 2), 'Table changed, press \'Update plot\'')
+        painter.end()
+
+    def resizeEvent(self, event):
+        self.rebuild()
+
+    def wheelEvent(self, event):
+        if self.view is None:
+            return
+        # zoom around the mouse position
+        factor = 0.8 if event.angleDelta().y() > 0 else 1.25
+        pos = event.pos()
+        xpos = self.view[0] + pos.x() / self.width() * (self.view[1] - self.view[0])
+        ypos = self.view[3] - pos.y() / self.height() * (self.view[3] - self.view[2])
+        self.view = (xpos - (xpos - self.view[0]) * factor, xpos + (self.view[1] - xpos) * factor,
+                     ypos - (ypos - self.view[2]) * factor, ypos + (self.view[3] - ypos) * factor)
+        self.rebuild()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self.view is not None:
+            self.dragstart = event.pos()
+            self.dragoffset = event.pos() - self.dragstart
+            self.dragview = self.view
+
+    def mouseMoveEvent(self, event):
+        if self.dragstart is not None:
+            # only move the image while dragging, the density is rebuilt on release
+            self.dragoffset = event.pos() - self.dragstart
+            dx = self.dragoffset.x() / self.width() * (self.dragview[1] - self.dragview[0])
+            dy = self.dragoffset.y() / self.height() * (self.dragview[3] - self.dragview[2])
+            self.view = (self.dragview[0] - dx, self.dragview[1] - dx, self.dragview[2] + dy, self.dragview[3] + dy)
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        if self.dragstart is not None:
+            self.dragstart = None
+            self.rebuild()
+
+    def mouseDoubleClickEvent(self, event):
+        self.reset_view()
 
 
 class MainApp(QWidget):
@@ -46,12 +422,27 @@ class MainApp(QWidget):
         self.rounddig = 3
         # which calculation mode to start in (Nittler or Admon - labels of radiobuttons)
         self.calcmode = 'Nittler'
+        # data type used for the transformation, 'float32' (compact mode) halves the memory for very large maps
+        self.calcdtype = 'float64'
+        # number of rows that are transformed at once, limits the size of temporary arrays
+        self.calcchunk = 100000
+        # undo history: memory budget in bytes and number of rows per stored chunk of a column
+        self.undobudget = 200 * 1024**2
+        self.undochunk = 1000
+        # reading files: bytes per block of a text file, rows per block of an excel file, and number of processes
+        # (None for the number of cores) to parse text files that consist of more than one block
+        self.readblocksize = 32 * 1024**2
+        self.readrowblock = 10000
+        self.readprocesses = None
+        # is a file being loaded? other actions on the table are blocked meanwhile
+        self.loading = False
+        self.undohistory = []
         # initialize the thing
         super().__init__()
         self.title = 'Coordinate Transformation'
         self.left = 50
         self.top = 80
-        self.width = 900
+        self.width = 1300
         # this is used for geometry but then also for tableheight. tableheight dominates!
         self.height = 845
 
@@ -116,6 +507,14 @@ class MainApp(QWidget):
         # add to layout
         toprowbutthlayout.addWidget(mnit_radio)
         toprowbutthlayout.addWidget(madm_radio)
+        # compact mode checkbox
+        compact_check = QCheckBox('Compact')
+        compact_check.setToolTip('Compact mode: Store the transformed coordinates in single precision (float32).\n'
+                                 'This halves the memory required for very large maps. The precision loss with\n'
+                                 'respect to a double precision (float64) calculation is shown after calculating.')
+        compact_check.setChecked(self.calcdtype == 'float32')
+        compact_check.toggled.connect(lambda: self.set_calcdtype(compact_check))
+        toprowbutthlayout.addWidget(compact_check)
         # add test, help, quit
         toprowbutthlayout.addStretch()
         if self.rundebug:
@@ -216,8 +615,18 @@ class MainApp(QWidget):
             self.datatable.setHorizontalHeaderItem(it, headers[it])
         # set up clipboard for table
         self.clip = QGuiApplication.clipboard()
-        # add table to widget
-        outervlayout.addWidget(self.datatable)
+        # add table and overview plot next to it to widget
+        tablehlayout = QHBoxLayout()
+        tablehlayout.addWidget(self.datatable)
+        overviewvlayout = QVBoxLayout()
+        self.overview = OverviewPlot(self)
+        overviewvlayout.addWidget(self.overview)
+        updateplot_butt = QPushButton('Update plot')
+        updateplot_butt.clicked.connect(self.refresh_overview)
+        updateplot_butt.setToolTip('Read the coordinates from the table and redraw the overview plot.')
+        overviewvlayout.addWidget(updateplot_butt)
+        tablehlayout.addLayout(overviewvlayout)
+        outervlayout.addLayout(tablehlayout)
         # bottom button row
         bottrowbutthlayout = QHBoxLayout()
         # add Row
@@ -229,9 +638,15 @@ class MainApp(QWidget):
         # clear table
         clear_butt = QPushButton('Clear all')
         clear_butt.clicked.connect(self.cleartable)
-        clear_butt.setToolTip('Clear all data in the table. A confirmation will be required, but after that, there\n'
-                              'is no undoing this action. Make sure you have the data, assuming you need it, saved.')
+        clear_butt.setToolTip('Clear all data in the table. A confirmation will be required, the action can be\n'
+                              'reverted with \'Undo\'.')
         bottrowbutthlayout.addWidget(clear_butt)
+        # undo
+        undo_butt = QPushButton('Undo')
+        undo_butt.clicked.connect(self.undo)
+        undo_butt.setToolTip('Undo the last change to the table, i.e., open, paste, delete, calculate, or clear.\n'
+                             'Older changes are forgotten when the history requires too much memory.')
+        bottrowbutthlayout.addWidget(undo_butt)
 
         bottrowbutthlayout.addStretch()
         # information on Fit
@@ -265,12 +680,15 @@ class MainApp(QWidget):
         open_shortcut.activated.connect(self.openfile)
         del_shortcut = QShortcut(QKeySequence("Del"), self)
         del_shortcut.activated.connect(self.delete)
+        undo_shortcut = QShortcut(QKeySequence("Ctrl+Z"), self)
+        undo_shortcut.activated.connect(self.undo)
 
     def context_menu(self, position):
         menu = QMenu()
         copyAction = menu.addAction("Copy")
         pasteAction = menu.addAction("Paste")
         delAction = menu.addAction("Delete")
+        undoAction = menu.addAction("Undo")
         action = menu.exec_(self.datatable.mapToGlobal(position))
         if action == copyAction:
             self.copy()
@@ -278,6 +696,8 @@ class MainApp(QWidget):
             self.paste()
         elif action == delAction:
             self.delete()
+        elif action == undoAction:
+            self.undo()
 
     def set_calcmode(self, rb):
         if rb.isChecked():
@@ -285,7 +705,18 @@ class MainApp(QWidget):
             if self.rundebug:
                 print(self.calcmode)
 
+    def set_calcdtype(self, cb):
+        if cb.isChecked():
+            self.calcdtype = 'float32'
+        else:
+            self.calcdtype = 'float64'
+        if self.rundebug:
+            print(self.calcdtype)
+
     def openfile(self):
+        if self.loading:
+            return
+
         # file dialog
         options = QFileDialog.Options()
         # options |= QFileDialog.DontUseNativeDialog
@@ -314,57 +745,199 @@ class MainApp(QWidget):
         usecol.append(xfidcol-1)
         usecol.append(yfidcol-1)
 
-        datain = None
-        # csv and txt read in:
-        try:
-            if sep == '.csv':
-                datain = pd.read_csv(filename, header=None, skiprows=headerrows, usecols=usecol)[usecol]
-            # separator:
-            elif sep == '.txt':
-                datain = pd.read_csv(filename, delimiter='\t', header=None, skiprows=headerrows, usecols=usecol)[usecol]
-            elif sep == '.xls' or sep == 'xlsx':
-                datain = pd.read_excel(filename, header=None, skiprows=headerrows, usecols=usecol)[usecol]
-        except KeyError or ValueError:
-            self.show_data_error()
-            return
+        # data types: names are strings, coordinates floats
+        dtype = {}
+        for col in usecol:
+            dtype[col] = np.float64
+        if namecol > 0:
+            dtype[namecol-1] = str
 
-        # first set the length of the table to be the length of the data
-        self.datatable.setRowCount(0)
         # name column present
         namecolpresent = False
         if namecol > 0:
             namecolpresent = True
 
-        # now add data rows
-        for it in range(datain.shape[0]):
-            row = []
-            if not namecolpresent:
-                row.append('')
-            for jt in range(datain.shape[1]):
-                row.append(datain.iloc[it, jt])
-            # add the row to the table
-            self.addTableRow(row)
+        # add the data block by block as it is read in, keep the coordinates for the overview plot
+        tablecleared = False
+        snapshotsaved = False
+        coords = []
+        readerror = None
+        # block other actions on the table while the rows are added
+        self.loading = True
+        self.datatable.setEnabled(False)
+        try:
+            for datain in self.read_datafile(filename, sep, headerrows, usecol, dtype):
+                if not tablecleared:
+                    # first set the length of the table to be the length of the data
+                    snapshotsaved = self.save_snapshot(range(self.datatable.columnCount()))
+                    self.datatable.setRowCount(0)
+                    tablecleared = True
+
+                # now add data rows
+                self.addTableRows(datain, namecolpresent)
+                coords.append(datain.iloc[:, datain.shape[1] - 4:].to_numpy(dtype=self.calcdtype))
+                # show the rows read so far
+                QApplication.processEvents()
+        except (KeyError, ValueError) as err:
+            readerror = err
+        finally:
+            self.loading = False
+            self.datatable.setEnabled(True)
+
+        if readerror is not None:
+            if tablecleared and not snapshotsaved:
+                # the table from before loading was not stored and cannot be restored
+                QMessageBox.warning(self, 'File error', 'Loading stopped partway because of an error in the file, '
+                                                        'the table is incomplete.\n\n' + str(readerror))
+                self.datatable.resizeColumnsToContents()
+                self.overview.set_stale()
+                return
+            # go back to the table from before loading
+            if tablecleared:
+                self.undo()
+            # pandas reports columns that are out of range as a ValueError about usecols
+            if isinstance(readerror, KeyError) or 'usecols' in str(readerror).lower():
+                self.show_data_error()
+            else:
+                self.show_read_error(readerror)
+            return
+
+        if not tablecleared:
+            QMessageBox.warning(self, 'No data found', 'No data was found in the file, the table was not changed. '
+                                                       'Please ensure that the file type is supported and that there '
+                                                       'are rows after the header rows.')
+            return
 
         # adjust table size
         self.datatable.resizeColumnsToContents()
+        coords = np.concatenate(coords) if coords else np.zeros((0, 4), dtype=self.calcdtype)
+        self.overview.set_data([DensityCloud.from_points(coords[:, 0], coords[:, 1]),
+                                DensityCloud.from_points(coords[:, 2], coords[:, 3])], np.zeros((0, 4)))
+
+    def read_datafile(self, filename, sep, headerrows, usecol, dtype):
+        """
+        Generator that reads the selected columns of a file and yields them block by block.
+
+        Delimited text files are split into blocks of self.readblocksize bytes at line breaks. If there is more than
+        one block, the blocks are parsed in parallel on a process pool, with at most two blocks per process in
+        flight. Fields with quoted line breaks are not supported. Rows of xlsx files are streamed and yielded in
+        blocks of self.readrowblock rows. Old xls files are parsed in one go and then yielded in blocks.
+
+        :param filename: file to read
+        :param sep: file ending, i.e., '.csv', '.txt', '.xls', or 'xlsx'
+        :param headerrows: number of header rows to skip
+        :param usecol: columns to read, in the order they are returned
+        :param dtype: dictionary with the data type of each column
+        :return: pd.DataFrame for each block
+        """
+        if sep == '.csv' or sep == '.txt':
+            if sep == '.csv':
+                delimiter = ','
+            else:
+                delimiter = '\t'
+            blocks = self.text_blocks(filename, headerrows)
+            if len(blocks) == 1:
+                yield read_text_block(filename, blocks[0][0], blocks[0][1], delimiter, usecol, dtype)
+            elif len(blocks) > 1:
+                # limit the blocks in flight, such that parsed blocks do not pile up while the table is filled
+                inflight = 2 * (self.readprocesses or os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=self.readprocesses) as executor:
+                    futures = deque()
+                    nextblock = 0
+                    try:
+                        while len(futures) > 0 or nextblock < len(blocks):
+                            while nextblock < len(blocks) and len(futures) < inflight:
+                                start, stop = blocks[nextblock]
+                                futures.append(executor.submit(read_text_block, filename, start, stop, delimiter,
+                                                               usecol, dtype))
+                                nextblock += 1
+                            yield futures.popleft().result()
+                    finally:
+                        # do not parse the remaining blocks if reading stopped early
+                        for future in futures:
+                            future.cancel()
+        elif sep == 'xlsx':
+            workbook = load_workbook(filename, read_only=True, data_only=True)
+            try:
+                sheet = workbook.worksheets[0]
+                # the stored dimensions can be wrong, use the actual rows instead
+                sheet.reset_dimensions()
+                # number of columns of the longest row, to find columns that do not exist
+                ncols = 0
+                rows = []
+                for rowind, values in enumerate(sheet.iter_rows(values_only=True)):
+                    ncols = max(ncols, len(values))
+                    if rowind < headerrows:
+                        continue
+                    row = [values[col] if col < len(values) else None for col in usecol]
+                    # skip empty rows
+                    if all([value is None for value in row]):
+                        continue
+                    rows.append(row)
+                    if len(rows) == self.readrowblock:
+                        yield excel_rows_to_frame(rows, usecol, dtype)
+                        rows = []
+                if len(rows) > 0:
+                    yield excel_rows_to_frame(rows, usecol, dtype)
+                if max(usecol) >= ncols:
+                    raise KeyError('Column ' + str(max(usecol) + 1) + ' not found.')
+            finally:
+                workbook.close()
+        elif sep == '.xls':
+            datain = pd.read_excel(filename, header=None, skiprows=headerrows, usecols=usecol, dtype=dtype)[usecol]
+            for start in range(0, datain.shape[0], self.readrowblock):
+                yield datain.iloc[start:start + self.readrowblock]
+
+    def text_blocks(self, filename, headerrows):
+        """
+        Split a text file after the header rows into blocks of about self.readblocksize bytes, at line breaks.
+
+        :param filename: file to split
+        :param headerrows: number of header rows to skip
+        :return: list of (start, stop) byte offsets of the blocks
+        """
+        size = os.path.getsize(filename)
+        blocks = []
+        with open(filename, 'rb') as f:
+            for it in range(headerrows):
+                f.readline()
+            start = f.tell()
+            while start < size:
+                # move to the end of the line where the block would end
+                f.seek(min(start + self.readblocksize, size))
+                f.readline()
+                stop = f.tell()
+                blocks.append((start, stop))
+                start = stop
+        return blocks
 
     def show_data_error(self):
         QMessageBox.warning(self, 'Requested data not found', 'Could not find the data you requested. Please ensure'
                                                               'that the data exists in the respective columns.')
 
-    def addTableRow(self, row_data):
+    def show_read_error(self, err):
+        QMessageBox.warning(self, 'File error', 'Could not read the file, the table was not changed. Please ensure '
+                                                'that the x, y, and reference columns only contain numbers.\n\n'
+                                                + str(err))
+
+    def addTableRows(self, datain, namecolpresent):
+        # add the rows of a pd.DataFrame to the end of the table, the name column stays empty if not present
         row = self.datatable.rowCount()
-        self.datatable.setRowCount(row+1)
-        col = 0
-        for item in row_data:
-            itemstr = str(item)
-            if itemstr == 'nan':
-                itemstr = ''
-            cell = QTableWidgetItem(itemstr)
-            self.datatable.setItem(row, col, cell)
-            col += 1
+        self.datatable.setRowCount(row + datain.shape[0])
+        col0 = 0 if namecolpresent else 1
+        for values in datain.itertuples(index=False):
+            for jt, item in enumerate(values):
+                itemstr = str(item)
+                if itemstr == 'nan':
+                    itemstr = ''
+                self.datatable.setItem(row, col0 + jt, QTableWidgetItem(itemstr))
+            row += 1
 
     def savefile(self, sep):
+        # not while a file is loading
+        if self.loading:
+            return
+
         # get file name from dialog
         if sep == 'txt':
             filename, _ = QFileDialog.getSaveFileName(self, 'Save File As', '',
@@ -430,6 +1003,10 @@ class MainApp(QWidget):
         msgBox.exec()
 
     def calculate(self):
+        # not while a file is loading
+        if self.loading:
+            return
+
         # admon or nittler
         if self.calcmode == 'Nittler':
             self.calculate_nittler()
@@ -443,128 +1020,71 @@ class MainApp(QWidget):
         # fake z coordinate
         zcoord = 1.
 
-        # initialize data input array as nan
-        tabold = np.full((self.datatable.rowCount(), 3), np.nan)
-        tabref = np.full((self.datatable.rowCount(), 2), np.nan)
-        for it in range(self.datatable.rowCount()):
-            # append data
-            if self.datatable.item(it, 1) is not None and self.datatable.item(it, 2) is not None:
-                try:
-                    if self.datatable.item(it, 1).text() is not '' and self.datatable.item(it, 2).text() is not '':
-                        tabold[it][0] = float(self.datatable.item(it, 1).text())
-                        tabold[it][1] = float(self.datatable.item(it, 2).text())
-                        tabold[it][2] = zcoord
-                except ValueError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please make sure '
-                                                             'all numbers are floats.')
-                    return
-                except AttributeError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in the data table. Did you finish all '
-                                                             'editing?')
-
-            # append reference
-            if self.datatable.item(it, 3) is not None and self.datatable.item(it, 4) is not None:
-                try:
-                    if self.datatable.item(it, 3).text() is not '' and self.datatable.item(it, 4).text() is not '':
-                        tabref[it][0] = float(self.datatable.item(it, 3).text())
-                        tabref[it][1] = float(self.datatable.item(it, 4).text())
-                except ValueError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please fix.')
-                    return
-                except AttributeError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in the data table. Did you finish all '
-                                                             'editing?')
-
-        # make sure at least two reference points are given
-        # now find crefold and crefnew for calculation of parameters
-        crefold = []
-        crefnew = []
-        for it in range(len(tabold)):
-            if not np.isnan(tabold[it][0]) and not np.isnan(tabref[it][0]):
-                crefold.append([tabold[it][0], tabold[it][1], zcoord])   # artificially add a z coordinate
-                crefnew.append([tabref[it][0], tabref[it][1], zcoord])   # artificially add a z coordinate
+        # read the reference points in double precision
+        try:
+            refold, refnew = self.read_references()
+        except ValueError:
+            QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please make sure '
+                                                     'all numbers are floats.')
+            return
 
-        if len(crefnew) < 3:
+        if len(refnew) < 3:
             QMessageBox.warning(self, 'Reference error', 'Need three reference points to transform into the '
                                                          'new coordinates.')
             return
-        if len(crefnew) > 3:
+        if len(refnew) > 3:
             QMessageBox.information(self, 'Too many reference points', 'Only the first three reference values are '
                                                                        'taken for the transformation.')
 
-        # transform to np.arrays, only take the first three entries
-        crefold = np.array(crefold[0:3])
-        crefnew = np.array(crefnew[0:3])
-        crefoldt = np.array(crefold).transpose()
-        crefnewt = np.array(crefnew).transpose()
-
-        tabnew = np.zeros((len(tabold), 2))
-        for it in range(len(tabold)):
-            tmpnew = np.matmul(crefnewt, np.matmul(np.linalg.inv(crefoldt), tabold[it]))
-            tabnew[it][0] = np.round(tmpnew[0], self.rounddig)
-            tabnew[it][1] = np.round(tmpnew[1], self.rounddig)
+        # only take the first three entries and artificially add a z coordinate
+        crefold = np.hstack((refold[0:3], np.full((3, 1), zcoord)))
+        crefnew = np.hstack((refnew[0:3], np.full((3, 1), zcoord)))
+        crefoldt = crefold.transpose()
+        crefnewt = crefnew.transpose()
+
+        # transformation matrix, the artificial z coordinate ends up in the offset
+        transmat = np.matmul(crefnewt, np.linalg.inv(crefoldt))
+        # transform and write the calc into the table, the overview clouds are filled along the way
+        oldcloud = DensityCloud(self.datatable.rowCount(), self.calcdtype)
+        calccloud = DensityCloud(self.datatable.rowCount(), self.calcdtype)
+        try:
+            precloss = self.transform_table(transmat[0:2, 0:2], transmat[0:2, 2] * zcoord, oldcloud, calccloud)
+        except ValueError:
+            QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please make sure '
+                                                     'all numbers are floats.')
+            return
 
-        # write the calc and the new into the table
-        for it in range(len(tabold)):
-            self.datatable.setItem(it, 5, QTableWidgetItem(str(tabnew[it][0])))
-            self.datatable.setItem(it, 6, QTableWidgetItem(str(tabnew[it][1])))
+        # set text in info label
+        if self.calcdtype != 'float64':
+            self.infolbl.setText('Precision loss (' + self.calcdtype + ' vs. float64): ' + '{:.3g}'.format(precloss))
+        else:
+            self.infolbl.setText('')
 
-        # resize columns to contents
-        self.datatable.resizeColumnsToContents()
+        # calculated reference points for the residuals in the overview
+        refcalc = np.matmul(refold, transmat[0:2, 0:2].transpose()) + transmat[0:2, 2] * zcoord
+        oldcloud.finish()
+        calccloud.finish()
+        self.overview.set_data([oldcloud, DensityCloud.from_points(refnew[:, 0], refnew[:, 1]), calccloud],
+                               np.hstack((refcalc, refnew)))
 
     def calculate_nittler(self):
         # stop editing
         self.datatable.setCurrentItem(None)
 
-        # initialize data input array as nan
-        tabold = np.full((self.datatable.rowCount(), 2), np.nan)
-        tabref = np.full((self.datatable.rowCount(), 2), np.nan)
-        for it in range(self.datatable.rowCount()):
-            # append data
-            if self.datatable.item(it, 1) is not None and self.datatable.item(it, 2) is not None:
-                try:
-                    if self.datatable.item(it, 1).text() is not '' and self.datatable.item(it, 2).text() is not '':
-                        tabold[it][0] = float(self.datatable.item(it, 1).text())
-                        tabold[it][1] = float(self.datatable.item(it, 2).text())
-                except ValueError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please make sure all '
-                                                             'numbers are floats.')
-                    return
-                except AttributeError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in the data table. Did you finish all '
-                                                         'editing?')
-
-            # append reference
-            if self.datatable.item(it, 3) is not None and self.datatable.item(it, 4) is not None:
-                try:
-                    if self.datatable.item(it, 3).text() is not '' and self.datatable.item(it, 4).text() is not '':
-                        tabref[it][0] = float(self.datatable.item(it, 3).text())
-                        tabref[it][1] = float(self.datatable.item(it, 4).text())
-                except ValueError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please fix.')
-                    return
-                except AttributeError:
-                    QMessageBox.warning(self, 'Table error', 'There is an error in the data table. Did you finish all '
-                                                             'editing?')
+        # read the reference points in double precision
+        try:
+            crefold, crefnew = self.read_references()
+        except ValueError:
+            QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please make sure all '
+                                                     'numbers are floats.')
+            return
 
         # make sure at least two reference points are given
-        # now find crefold and crefnew for calculation of parameters
-        crefold = []
-        crefnew = []
-        for it in range(len(tabold)):
-            if not np.isnan(tabold[it][0]) and not np.isnan(tabref[it][0]):
-                crefold.append([tabold[it][0], tabold[it][1]])
-                crefnew.append([tabref[it][0], tabref[it][1]])
-
         if len(crefnew) < 2:
             QMessageBox.warning(self, 'Reference error', 'Need at least two reference points to transform into the '
                                                          'new coordinates.')
             return
 
-        # transform to np.arrays
-        crefold = np.array(crefold)
-        crefnew = np.array(crefnew)
-
         # now calculate what i need to calculate with all the reference values, all variables start with var
         vara = 0.
         varb = 0.
@@ -589,13 +1109,17 @@ class MainApp(QWidget):
                                                                        varb * vare + varc * varf - vara * varg,
                                                                        varc * vare - varb * varf - vara * varh])
 
-        tabnew = np.zeros((len(tabold), 2))
-        for it in range(len(tabnew)):
-            if not np.isnan(tabold[it][0]):
-                tabnew[it][0] = np.round(tabold[it][0] * params[0] + tabold[it][1] * params[1] + params[2],
-                                         self.rounddig)
-                tabnew[it][1] = np.round(-tabold[it][0] * params[1] + tabold[it][1] * params[0] + params[3],
-                                         self.rounddig)
+        # transform the data: x_calc = x * a + y * b + c, y_calc = - x * b + y * a + d
+        # and write the calc into the table, the overview clouds are filled along the way
+        oldcloud = DensityCloud(self.datatable.rowCount(), self.calcdtype)
+        calccloud = DensityCloud(self.datatable.rowCount(), self.calcdtype)
+        try:
+            precloss = self.transform_table(np.array([[params[0], params[1]], [-params[1], params[0]]]),
+                                            np.array([params[2], params[3]]), oldcloud, calccloud)
+        except ValueError:
+            QMessageBox.warning(self, 'Table error', 'There is an error in your data table. Please make sure all '
+                                                     'numbers are floats.')
+            return
 
         # calculate the reference
         crefcalc = []
@@ -612,17 +1136,145 @@ class MainApp(QWidget):
         dsane /= len(crefnew)
 
         # set text in info label
-        self.infolbl.setText('Average distance error: ' + str(np.round(dsane, self.rounddig)))
-
-        # write the calc and the new into the table
-        for it in range(len(tabold)):
-            self.datatable.setItem(it, 5, QTableWidgetItem(str(tabnew[it][0])))
-            self.datatable.setItem(it, 6, QTableWidgetItem(str(tabnew[it][1])))
+        infotext = 'Average distance error: ' + str(np.round(dsane, self.rounddig))
+        if self.calcdtype != 'float64':
+            infotext += ', precision loss (' + self.calcdtype + ' vs. float64): ' + '{:.3g}'.format(precloss)
+        self.infolbl.setText(infotext)
+
+        oldcloud.finish()
+        calccloud.finish()
+        self.overview.set_data([oldcloud, DensityCloud.from_points(crefnew[:, 0], crefnew[:, 1]), calccloud],
+                               np.hstack((np.array(crefcalc), crefnew)))
+
+    def read_coordinates(self, rowstart, rowstop, col):
+        """
+        Read the coordinates in the columns col and col + 1 of the given rows in double precision. A ValueError is
+        raised if a cell does not contain a number.
+
+        :param rowstart: first row to read
+        :param rowstop: row after the last one to read
+        :param col: column of the x coordinate
+        :return: np.array (rowstop - rowstart, 2), nan where no coordinates are given
+        """
+        tab = np.full((rowstop - rowstart, 2), np.nan)
+        for it in range(rowstart, rowstop):
+            xitem = self.datatable.item(it, col)
+            yitem = self.datatable.item(it, col + 1)
+            if xitem is not None and yitem is not None and xitem.text() != '' and yitem.text() != '':
+                tab[it - rowstart][0] = float(xitem.text())
+                tab[it - rowstart][1] = float(yitem.text())
+        return tab
+
+    def read_references(self):
+        """
+        Read the rows that have old and reference coordinates in double precision. Only these rows are stored.
+
+        :return: crefold, crefnew: np.arrays (k, 2) with the old and the reference coordinates
+        """
+        crefold = []
+        crefnew = []
+        for start in range(0, self.datatable.rowCount(), self.calcchunk):
+            stop = min(start + self.calcchunk, self.datatable.rowCount())
+            refblock = self.read_coordinates(start, stop, 3)
+            for it in np.nonzero(~np.isnan(refblock[:, 0]))[0]:
+                old = self.read_coordinates(start + it, start + it + 1, 1)[0]
+                if not np.isnan(old[0]):
+                    crefold.append(old)
+                    crefnew.append(refblock[it])
+        return np.array(crefold).reshape((-1, 2)), np.array(crefnew).reshape((-1, 2))
+
+    def transform_table(self, transmat, offset, oldcloud, calccloud):
+        """
+        Read the old coordinates from the table, apply the affine transformation x @ transmat.T + offset, rounded to
+        self.rounddig digits, and write the result straight into the x_calc and y_calc columns. Rows are read and
+        transformed in double precision in blocks of self.calcchunk, such that no full size arrays are created. The
+        written values are rounded to self.calcdtype. If a cell is not a number, the calc columns are restored and a
+        ValueError is raised.
+
+        :param transmat: np.array (2, 2) transformation matrix
+        :param offset: np.array (2) offset
+        :param oldcloud: DensityCloud that is filled with the old coordinates
+        :param calccloud: DensityCloud that is filled with the transformed coordinates
+        :return: maximum absolute deviation of the written coordinates from the float64 calculation, 0. if
+            self.calcdtype is float64
+        """
+        transmatt = np.array(transmat, dtype=np.float64).transpose()
+        offset = np.array(offset, dtype=np.float64)
+        rowcount = self.datatable.rowCount()
+        snapshotsaved = self.save_snapshot([5, 6])
+        precloss = 0.
+        for start in range(0, rowcount, self.calcchunk):
+            stop = min(start + self.calcchunk, rowcount)
+            try:
+                block = self.read_coordinates(start, stop, 1)
+            except ValueError:
+                if snapshotsaved:
+                    # go back to the calc columns from before
+                    self.undo()
+                else:
+                    # no results rather than partial ones
+                    for it in range(start):
+                        self.datatable.setItem(it, 5, QTableWidgetItem(''))
+                        self.datatable.setItem(it, 6, QTableWidgetItem(''))
+                raise
+            blocknew = np.matmul(block, transmatt)
+            blocknew += offset
+            np.round(blocknew, self.rounddig, out=blocknew)
+            stored = blocknew.astype(self.calcdtype)
+            # compare the stored, possibly lower precision, values to the float64 calculation
+            if stored.dtype != np.float64:
+                blockloss = np.abs(stored - blocknew)
+                if np.any(~np.isnan(blockloss)):
+                    precloss = max(precloss, float(np.nanmax(blockloss)))
+            oldcloud.add(start, block[:, 0], block[:, 1])
+            calccloud.add(start, stored[:, 0], stored[:, 1])
+
+            # write the calc into the table, empty cells where no data was given
+            for it in range(stop - start):
+                for jt in range(2):
+                    if np.isnan(stored[it][jt]):
+                        itemstr = ''
+                    else:
+                        itemstr = str(stored[it][jt])
+                    self.datatable.setItem(start + it, 5 + jt, QTableWidgetItem(itemstr))
 
         # resize columns to contents
         self.datatable.resizeColumnsToContents()
+        return precloss
+
+    def refresh_overview(self):
+        # read the coordinates from the table block by block, nan where no number is given
+        if self.loading:
+            return
+        rowcount = self.datatable.rowCount()
+        clouds = [DensityCloud(rowcount, self.calcdtype) for it in range(3)]
+        resid = []
+        for start in range(0, rowcount, self.calcchunk):
+            stop = min(start + self.calcchunk, rowcount)
+            block = np.full((stop - start, 6), np.nan)
+            for it in range(start, stop):
+                for jt in range(6):
+                    item = self.datatable.item(it, jt + 1)
+                    if item is not None:
+                        try:
+                            block[it - start][jt] = float(item.text())
+                        except ValueError:
+                            pass
+            for jt, cloud in enumerate(clouds):
+                cloud.add(start, block[:, 2 * jt], block[:, 2 * jt + 1])
+            # residuals of the reference points: x_calc, y_calc, x_ref, y_ref
+            blockresid = block[:, [4, 5, 2, 3]]
+            resid.append(blockresid[np.all(np.isfinite(blockresid), axis=1)])
+        for cloud in clouds:
+            cloud.finish()
+        resid = np.concatenate(resid) if resid else np.zeros((0, 4))
+        self.overview.set_data(clouds, resid)
 
     def addrow(self):
+        # not while a file is loading
+        if self.loading:
+            return
+
         self.datatable.insertRow(self.datatable.rowCount())
 
     # def keyPressEvent(self, event):
@@ -673,6 +1325,10 @@ class MainApp(QWidget):
         self.clipboard.setText(str2cpy)
 
     def paste(self):
+        # not while a file is loading
+        if self.loading:
+            return
+
         # get the current index
         try:
             tmp = self.datatable.selectedIndexes()[0]
@@ -692,13 +1348,17 @@ class MainApp(QWidget):
         for line in datain:
             data.append(line.replace('\r','').split())
 
+        # number of columns to paste, lines can have different numbers of fields
+        ncols = max([len(line) for line in data])
+
         # check if outside of range in horizontal
-        if currind[1] + len(data[0]) > 7:
+        if currind[1] + ncols > 7:
             QMessageBox.warning(self, 'Paste error', 'Too many columns in clipboard to fit. Wrong selection where to '
                                                      'paste into?')
             return
 
         # add rows in the end until we have enough to paste into
+        self.save_snapshot(range(currind[1], currind[1] + ncols), currind[0], currind[0] + len(data))
         while currind[0] + len(data) > self.datatable.rowCount():
             self.datatable.insertRow(self.datatable.rowCount())
 
@@ -706,8 +1366,13 @@ class MainApp(QWidget):
         for row in range(len(data)):
             for col in range(len(data[row])):
                 self.datatable.setItem(row + currind[0], col+currind[1], QTableWidgetItem(data[row][col]))
+        self.overview.set_stale()
 
     def delete(self):
+        # not while a file is loading
+        if self.loading:
+            return
+
         # get the current index
         inds = []
         try:
@@ -720,21 +1385,133 @@ class MainApp(QWidget):
         print(inds)
 
         # now fill the cells with the pasted stuff
+        if inds:
+            rows = [row for row, _ in inds]
+            self.save_snapshot(set([col for _, col in inds]), min(rows), max(rows) + 1)
         for row, col in inds:
             self.datatable.setItem(row, col, QTableWidgetItem(''))
+        if inds:
+            self.overview.set_stale()
 
     def cleartable(self):
+        # not while a file is loading
+        if self.loading:
+            return
+
         # clear the table
         msgbox = QMessageBox.question(self, 'Clear table?', 'Are you sure you want to clear the table?',
                                       QMessageBox.Yes, QMessageBox.No)
 
         if msgbox == QMessageBox.Yes:
+            self.save_snapshot(range(self.datatable.columnCount()))
             self.datatable.clearContents()
             self.datatable.setRowCount(23)
+            self.overview.set_data([], np.zeros((0, 4)))
             # set geometry
 
+    def save_snapshot(self, cols, rowstart=0, rowstop=None):
+        """
+        Store the given part of the table in the undo history before it is overwritten. Only the touched columns are
+        stored, in chunks of self.undochunk rows. A chunk that did not change since it was last stored is shared with
+        the older snapshot, such that the history grows with the changed data only. The oldest snapshots are dropped
+        when the history exceeds self.undobudget bytes. A snapshot that alone exceeds the budget is not stored, the
+        user is told that the change cannot be undone and the history is cleared, since older snapshots cannot be
+        restored on top of a change that is not recorded.
+
+        :param cols: columns that will be changed
+        :param rowstart: first row that will be changed
+        :param rowstop: row after the last one that will be changed, None for all rows
+        :return: True if the snapshot was stored, False if not
+        """
+        rowcount = self.datatable.rowCount()
+        if rowstop is None or rowstop > rowcount:
+            rowstop = rowcount
+
+        chunks = {}
+        # memory of the chunks that are not shared, and of all chunks of this snapshot
+        size = 0
+        fullsize = 0
+        if rowstart < rowstop:
+            for col in cols:
+                for chunkind in range(rowstart // self.undochunk, (rowstop - 1) // self.undochunk + 1):
+                    chunkrows = range(chunkind * self.undochunk, min((chunkind + 1) * self.undochunk, rowcount))
+                    chunk = tuple([self.cell_text(row, col) for row in chunkrows])
+                    # share the chunk with the most recent snapshot that stored it, if the data is the same
+                    shared = False
+                    for snapshot in reversed(self.undohistory):
+                        if (col, chunkind) in snapshot['chunks']:
+                            if snapshot['chunks'][(col, chunkind)] == chunk:
+                                chunk = snapshot['chunks'][(col, chunkind)]
+                                shared = True
+                            break
+                    chunksize = self.chunk_size(chunk)
+                    if not shared:
+                        size += chunksize
+                    fullsize += chunksize
+                    chunks[(col, chunkind)] = chunk
+
+                    # stop as soon as the snapshot is too large
+                    if fullsize > self.undobudget:
+                        self.undohistory = []
+                        QMessageBox.information(self, 'Undo', 'The table is too large to keep this change in the undo '
+                                                              'history, it cannot be undone. The undo history was '
+                                                              'cleared.')
+                        return False
+
+        self.undohistory.append({'rowcount': rowcount, 'chunks': chunks, 'size': size})
+
+        # drop the oldest snapshots if the budget is exceeded, the newest one fits into the budget
+        while len(self.undohistory) > 1 and sum([snap['size'] for snap in self.undohistory]) > self.undobudget:
+            oldest = self.undohistory.pop(0)
+            # chunks shared with newer snapshots are now accounted for by those
+            for key, chunk in oldest['chunks'].items():
+                for snapshot in self.undohistory:
+                    if snapshot['chunks'].get(key) is chunk:
+                        snapshot['size'] += self.chunk_size(chunk)
+                        break
+        return True
+
+    def chunk_size(self, chunk):
+        # approximate memory in bytes of a stored chunk
+        return sys.getsizeof(chunk) + sum([sys.getsizeof(txt) for txt in chunk if txt is not None])
+
+    def cell_text(self, row, col):
+        # text of a cell, None if the cell has no item
+        item = self.datatable.item(row, col)
+        if item is None:
+            return None
+        return item.text()
+
+    def undo(self):
+        # not while a file is loading
+        if self.loading:
+            return
+
+        # stop editing
+        self.datatable.setCurrentItem(None)
+
+        if len(self.undohistory) == 0:
+            QMessageBox.information(self, 'Undo', 'Nothing to undo.')
+            return
+
+        snapshot = self.undohistory.pop()
+        self.datatable.setRowCount(snapshot['rowcount'])
+        for (col, chunkind), chunk in snapshot['chunks'].items():
+            for it, txt in enumerate(chunk):
+                row = chunkind * self.undochunk + it
+                if txt is None:
+                    self.datatable.takeItem(row, col)
+                else:
+                    self.datatable.setItem(row, col, QTableWidgetItem(txt))
+
+        # resize columns to contents
+        self.datatable.resizeColumnsToContents()
+        self.overview.set_stale()
+
 
 if __name__ == '__main__':
+    # required for the process pool in the frozen application
+    freeze_support()
     appctxt = ApplicationContext()
     ex = MainApp()
     exit_code = appctxt.app.exec_()  # 2. Invoke appctxt.app.exec_()